@@ -0,0 +1,49 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from database_setup import create_database
+from loan_manager import LoanManagementSystem
+
+# Compares peak Python memory of streaming (iter_all_loans) and list (get_all_loans) reads
+# over a freshly seeded database in a temporary folder.
+
+def seed_loans(system, rows):
+    system.cursor.execute("INSERT INTO borrowers (full_name) VALUES ('Benchmark Borrower')")
+    system.cursor.execute('WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < ?) '
+                          'INSERT INTO loans (borrower_id, amount, interest_rate, term_months, start_date, status) '
+                          "SELECT 1, 1000 + x % 50000, 5, 12, '2025-01-01', 'Active' FROM n", (rows,))
+    system.conn.commit()
+
+def measure(name, read):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = sum(1 for row in read())
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:<28} {count:>10} rows  peak {peak / 1024 / 1024:10.2f} MiB  {elapsed:8.2f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory benchmark for streaming loan reads")
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--skip-list', action='store_true', help="only measure iter_all_loans")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        create_database()
+        system = LoanManagementSystem()
+        print(f"Seeding {args.rows} loans...")
+        seed_loans(system, args.rows)
+        # The list run goes last since it holds every row in memory at once
+        measure("iter_all_loans()", system.iter_all_loans)
+        measure("iter_all_loans(named=True)", lambda: system.iter_all_loans(named=True))
+        if not args.skip_list:
+            measure("get_all_loans()", system.get_all_loans)
+        system.close()
+        os.chdir(os.path.dirname(folder))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.image as mpimg
+
+# Rendered charts kept in memory, oldest dropped first
+CACHE_SIZE = 16
+
+CHART_SIZE = (6, 4)
+CHART_DPI = 100
+BG_COLOR = '#F0F0F0'
+TEXT_COLOR = '#333333'
+
+def chart_key(kind, data):
+    payload = json.dumps([kind, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def draw_status_pie(ax, status_data):
+    labels = [status for status, count in status_data]
+    counts = [count for status, count in status_data]
+    ax.pie(counts, labels=labels, autopct='%1.1f%%', colors=['#0078D7', '#FF5722', '#2196F3'])
+    ax.set_title("Loan Status Distribution", color=TEXT_COLOR)
+
+def draw_amount_histogram(ax, amount_bins):
+    edges = [start for start, end, count in amount_bins] + [amount_bins[-1][1]]
+    centers = [(start + end) / 2 for start, end, count in amount_bins]
+    counts = [count for start, end, count in amount_bins]
+    ax.hist(centers, bins=edges, weights=counts, color='#0078D7', edgecolor='white')
+    ax.set_title("Loan Amount Distribution", color=TEXT_COLOR)
+    ax.set_xlabel("Amount (₱)", color=TEXT_COLOR)
+    ax.set_ylabel("Count", color=TEXT_COLOR)
+    ax.set_facecolor('#FFFFFF')
+    ax.tick_params(colors=TEXT_COLOR)
+
+CHARTS = {
+    'status': draw_status_pie,
+    'amounts': draw_amount_histogram,
+}
+
+class ChartRenderer:
+    # Renders charts to PNG bytes on a worker thread with the Agg backend. Results are
+    # cached by a hash of the chart's data, so unchanged data is never drawn twice.
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def render(self, kind, data):
+        key = chart_key(kind, data)
+        with self.lock:
+            future = self.cache.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self.executor.submit(self.draw, kind, data)
+                self.cache[key] = future
+                while len(self.cache) > CACHE_SIZE:
+                    self.cache.popitem(last=False)
+            else:
+                self.cache.move_to_end(key)
+        return key, future
+
+    def draw(self, kind, data):
+        # Figure is used directly rather than pyplot, which is not thread-safe
+        fig = Figure(figsize=CHART_SIZE, dpi=CHART_DPI)
+        FigureCanvasAgg(fig)
+        fig.set_facecolor(BG_COLOR)
+        CHARTS[kind](fig.add_subplot(), data)
+        buffer = BytesIO()
+        fig.savefig(buffer, format='png', facecolor=fig.get_facecolor())
+        return buffer.getvalue()
+
+    def export_summary(self, file_path, charts, title):
+        # Lays the cached chart images out side by side; the format follows the file extension
+        images = [self.render(kind, data)[1].result() for kind, data in charts]
+        width, height = CHART_SIZE
+        fig = Figure(figsize=(width * max(len(images), 1), height + 1), dpi=CHART_DPI)
+        FigureCanvasAgg(fig)
+        fig.set_facecolor(BG_COLOR)
+        fig.suptitle(title, color=TEXT_COLOR)
+        for index, image in enumerate(images):
+            ax = fig.add_subplot(1, len(images), index + 1)
+            ax.imshow(mpimg.imread(BytesIO(image), format='png'))
+            ax.axis('off')
+        fig.savefig(file_path, facecolor=fig.get_facecolor(), bbox_inches='tight')
+
+    def close(self):
+        self.executor.shutdown(wait=False)
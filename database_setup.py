@@ -1,8 +1,19 @@
 import sqlite3
 import hashlib
+import uuid
+
+# Seconds a connection waits for another instance's lock before giving up
+BUSY_TIMEOUT = 5.0
+
+# Tables whose row changes are recorded in change_log for delta sync
+TRACKED_TABLES = {
+    'borrowers': 'borrower_id',
+    'loans': 'loan_id',
+    'payments': 'payment_id',
+}
 
 def create_database():
-    conn = sqlite3.connect('loan_management.db')
+    conn = sqlite3.connect('loan_management.db', timeout=BUSY_TIMEOUT)
     cursor = conn.cursor()
     
     # Create Borrowers table with updated fields
@@ -52,6 +63,96 @@ def create_database():
         )
     ''')
 
+    # Covering index for per-loan balance sums
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_loan_amount ON payments (loan_id, amount)')
+
+    # Covering indexes for date-range reports
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_date_amount ON payments (payment_date, amount)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_loans_start_date_amount ON loans (start_date, amount)')
+
+    # Per-day totals for closed days (before today), filled in by the reports
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            day TEXT PRIMARY KEY,
+            collections_count INTEGER NOT NULL,
+            collections_amount REAL NOT NULL,
+            disbursements_count INTEGER NOT NULL,
+            disbursements_amount REAL NOT NULL
+        )
+    ''')
+
+    # Change tracking for delta sync between installations
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'change_log'")
+    new_change_log = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            operation TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log (table_name, row_id, seq)')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_peers (
+            site_id TEXT PRIMARY KEY,
+            last_seq INTEGER NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_conflicts (
+            conflict_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            site_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            operation TEXT NOT NULL,
+            incoming_row TEXT,
+            reason TEXT NOT NULL,
+            detected_at TEXT NOT NULL
+        )
+    ''')
+
+    # Site that created each imported row; rows without an entry were created locally
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS row_origins (
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            site_id TEXT NOT NULL,
+            PRIMARY KEY (table_name, row_id)
+        )
+    ''')
+
+    cursor.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('site_id', ?)", (uuid.uuid4().hex,))
+    cursor.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('tracking', 'on')")
+    cursor.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('last_export_seq', '0')")
+
+    # Rows that existed before tracking was added go out with the first export
+    if new_change_log:
+        for table, key in TRACKED_TABLES.items():
+            cursor.execute(f"INSERT INTO change_log (table_name, row_id, operation) SELECT '{table}', {key}, 'INSERT' FROM {table}")
+
+    # Changes are not logged while tracking is 'off' (imports and archival)
+    for table, key in TRACKED_TABLES.items():
+        for operation, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_{operation.lower()}_log
+                AFTER {operation} ON {table}
+                WHEN (SELECT value FROM sync_state WHERE key = 'tracking') IS NOT 'off'
+                BEGIN
+                    INSERT INTO change_log (table_name, row_id, operation) VALUES ('{table}', {row}.{key}, '{operation}');
+                END
+            ''')
+
     # Add default admin user if not exists
     default_username = "admin"
     default_password = "password"
@@ -65,5 +166,33 @@ def create_database():
     conn.commit()
     conn.close()
 
+def create_archive_tables(cursor, schema='archive'):
+    # Archived rows keep their original ids, so these tables have no AUTOINCREMENT
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}.loans (
+            loan_id INTEGER PRIMARY KEY,
+            borrower_id INTEGER,
+            amount REAL NOT NULL,
+            interest_rate REAL NOT NULL,
+            term_months INTEGER NOT NULL,
+            start_date TEXT NOT NULL,
+            status TEXT NOT NULL
+        )
+    ''')
+
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}.payments (
+            payment_id INTEGER PRIMARY KEY,
+            loan_id INTEGER,
+            amount REAL NOT NULL,
+            payment_date TEXT NOT NULL,
+            balance_after_payment REAL NOT NULL
+        )
+    ''')
+
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_archive_payments_loan_id ON payments (loan_id)')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_archive_payments_date_amount ON payments (payment_date, amount)')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_archive_loans_start_date_amount ON loans (start_date, amount)')
+
 if __name__ == "__main__":
     create_database()
\ No newline at end of file
@@ -1,17 +1,18 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import pandas as pd
+from tkinter import ttk, messagebox, filedialog, simpledialog
 from loan_manager import LoanManagementSystem
+from chart_renderer import ChartRenderer
 from datetime import datetime
-import shutil
+import sqlite3
 import os
+import base64
 from PIL import Image, ImageTk
 
 class LoanApp:
     def __init__(self, root, show_login_callback):
         self.system = LoanManagementSystem()
+        self.charts = ChartRenderer()
+        self.chart_photos = {}
         self.root = root
         self.show_login_callback = show_login_callback
         self.root.title("Offline Loan Management System")
@@ -147,31 +148,37 @@ class LoanApp:
         charts_frame = ttk.Frame(self.dashboard_content)
         charts_frame.pack(pady=20, fill='both', expand=True)
         
-        # Status pie chart
-        status_df = pd.DataFrame(data['status_data'], columns=['Status', 'Count'])
-        fig1, ax1 = plt.subplots(figsize=(6, 4))
-        ax1.pie(status_df['Count'], labels=status_df['Status'], autopct='%1.1f%%', colors=['#0078D7', '#FF5722', '#2196F3'])
-        ax1.set_title("Loan Status Distribution", color='#333333')
-        fig1.set_facecolor('#F0F0F0')
-        
-        canvas1 = FigureCanvasTkAgg(fig1, master=charts_frame)
-        canvas1.draw()
-        canvas1.get_tk_widget().grid(row=0, column=0, padx=20)
-        
-        # Amount distribution histogram
-        if data['amounts']:
-            fig2, ax2 = plt.subplots(figsize=(6, 4))
-            ax2.hist(data['amounts'], bins=10, color='#0078D7', edgecolor='white')
-            ax2.set_title("Loan Amount Distribution", color='#333333')
-            ax2.set_xlabel("Amount (₱)", color='#333333')
-            ax2.set_ylabel("Count", color='#333333')
-            fig2.set_facecolor('#F0F0F0')
-            ax2.set_facecolor('#FFFFFF')
-            ax2.tick_params(colors='#333333')
-            
-            canvas2 = FigureCanvasTkAgg(fig2, master=charts_frame)
-            canvas2.draw()
-            canvas2.get_tk_widget().grid(row=0, column=1, padx=20)
+        for column, (kind, chart_data) in enumerate(self.dashboard_charts(data)):
+            chart_label = ttk.Label(charts_frame)
+            chart_label.grid(row=0, column=column, padx=20)
+            self.show_chart(chart_label, kind, chart_data)
+
+    def dashboard_charts(self, data):
+        charts = [('status', data['status_data'])]
+        if data['amount_bins']:
+            charts.append(('amounts', data['amount_bins']))
+        return charts
+
+    def show_chart(self, label, kind, chart_data):
+        # Charts render off the Tk thread; poll until the image is ready, then show it
+        key, future = self.charts.render(kind, chart_data)
+
+        def display():
+            if not label.winfo_exists():
+                return
+            if not future.done():
+                self.root.after(50, display)
+                return
+            if future.exception() is not None:
+                label.configure(text="Chart unavailable")
+                return
+            cached_key, photo = self.chart_photos.get(kind, (None, None))
+            if cached_key != key:
+                photo = tk.PhotoImage(data=base64.b64encode(future.result()))
+                self.chart_photos[kind] = (key, photo)
+            label.configure(image=photo)
+
+        display()
 
     def setup_borrower_tab(self):
         form_frame = ttk.Frame(self.borrower_frame)
@@ -228,6 +235,7 @@ class LoanApp:
         self.borrower_listbox.heading("ID Type", text="ID Type")
         self.borrower_listbox.heading("ID Number", text="ID Number")
         self.borrower_listbox.pack(pady=10, padx=10, fill='both', expand=True)
+        self.borrower_rows = {}
         self.update_borrower_list()
 
     def setup_loan_tab(self):
@@ -272,6 +280,7 @@ class LoanApp:
         self.loan_listbox.heading("Status", text="Status")
         self.loan_listbox.heading("Balance", text="Balance")
         self.loan_listbox.pack(pady=10, padx=10, fill='both', expand=True)
+        self.loan_rows = {}
         self.update_loan_list()
 
     def setup_payment_tab(self):
@@ -299,6 +308,42 @@ class LoanApp:
         
         ttk.Button(report_frame, text="Export Loan Report to CSV", command=self.export_report, image=self.export_report_icon, compound=tk.LEFT).grid(row=0, column=0, padx=5, pady=5)
         ttk.Button(report_frame, text="Backup Database", command=self.backup_database, image=self.backup_db_icon, compound=tk.LEFT).grid(row=0, column=1, padx=5, pady=5)
+        ttk.Button(report_frame, text="Archive Paid Loans", command=self.archive_paid_loans, image=self.backup_db_icon, compound=tk.LEFT).grid(row=0, column=2, padx=5, pady=5)
+
+        ttk.Label(report_frame, text="Archive loans paid off more than (days)").grid(row=1, column=0, padx=5, pady=5)
+        self.archive_age_entry = ttk.Entry(report_frame)
+        self.archive_age_entry.insert(0, "365")
+        self.archive_age_entry.grid(row=1, column=1, padx=5, pady=5)
+        self.include_archived_var = tk.BooleanVar()
+        ttk.Checkbutton(report_frame, text="Include archived loans in report", variable=self.include_archived_var).grid(row=1, column=2, padx=5, pady=5)
+
+        ttk.Button(report_frame, text="Export Changes", command=self.export_changes, image=self.export_report_icon, compound=tk.LEFT).grid(row=2, column=0, padx=5, pady=5)
+        ttk.Button(report_frame, text="Import Changes", command=self.import_changes, image=self.backup_db_icon, compound=tk.LEFT).grid(row=2, column=1, padx=5, pady=5)
+        ttk.Button(report_frame, text="New Installation ID", command=self.reset_site_id, image=self.backup_db_icon, compound=tk.LEFT).grid(row=2, column=3, padx=5, pady=5)
+        ttk.Button(report_frame, text="Export Portfolio Summary", command=self.export_portfolio_summary, image=self.export_report_icon, compound=tk.LEFT).grid(row=2, column=2, padx=5, pady=5)
+
+        # Collections / disbursements by period
+        period_frame = ttk.Frame(self.report_frame)
+        period_frame.pack(pady=10, padx=10, fill='x')
+        ttk.Label(period_frame, text="From (YYYY-MM-DD)").grid(row=0, column=0, padx=5, pady=5)
+        self.report_start_entry = ttk.Entry(period_frame)
+        self.report_start_entry.insert(0, datetime.now().strftime("%Y-01-01"))
+        self.report_start_entry.grid(row=0, column=1, padx=5, pady=5)
+        ttk.Label(period_frame, text="To (YYYY-MM-DD)").grid(row=0, column=2, padx=5, pady=5)
+        self.report_end_entry = ttk.Entry(period_frame)
+        self.report_end_entry.insert(0, datetime.now().strftime("%Y-%m-%d"))
+        self.report_end_entry.grid(row=0, column=3, padx=5, pady=5)
+        ttk.Label(period_frame, text="Group By").grid(row=0, column=4, padx=5, pady=5)
+        self.report_period_var = tk.StringVar(value="Day")
+        ttk.Combobox(period_frame, textvariable=self.report_period_var, values=["Day", "Week", "Month"], state='readonly', width=8).grid(row=0, column=5, padx=5, pady=5)
+        ttk.Button(period_frame, text="Collections", command=lambda: self.show_period_report("collections"), image=self.report_icon, compound=tk.LEFT).grid(row=0, column=6, padx=5, pady=5)
+        ttk.Button(period_frame, text="Disbursements", command=lambda: self.show_period_report("disbursements"), image=self.report_icon, compound=tk.LEFT).grid(row=0, column=7, padx=5, pady=5)
+
+        self.period_report_listbox = ttk.Treeview(self.report_frame, columns=("Period", "Count", "Total"), show="headings")
+        self.period_report_listbox.heading("Period", text="Period")
+        self.period_report_listbox.heading("Count", text="Count")
+        self.period_report_listbox.heading("Total", text="Total")
+        self.period_report_listbox.pack(pady=10, padx=10, fill='both', expand=True)
 
     def add_borrower(self):
         full_name = self.full_name_entry.get().strip()
@@ -324,7 +369,7 @@ class LoanApp:
             self.address_entry.delete(0, tk.END)
             self.id_type_entry.delete(0, tk.END)
             self.id_number_entry.delete(0, tk.END)
-            self.update_borrower_list()
+            self.update_borrower_list({borrower_id})
             self.update_dropdowns()
             self.update_dashboard()
         else:
@@ -351,7 +396,7 @@ class LoanApp:
                 self.amount_entry.delete(0, tk.END)
                 self.interest_entry.delete(0, tk.END)
                 self.term_entry.delete(0, tk.END)
-                self.update_loan_list()
+                self.update_loan_list({loan_id})
                 self.update_dashboard()
             else:
                 messagebox.showerror("Error", "Failed to add loan")
@@ -378,55 +423,173 @@ class LoanApp:
                 messagebox.showinfo("Success", f"Payment recorded. New balance: ₱{result:.2f}")
                 self.payment_loan_id_entry.delete(0, tk.END)
                 self.payment_amount_entry.delete(0, tk.END)
-                self.update_loan_list()
+                self.update_loan_list({loan_id})
                 self.update_dashboard()
         except ValueError:
             messagebox.showerror("Error", "Invalid input")
 
     def search_borrowers(self):
         query = self.borrower_search_entry.get().strip()
-        for i in self.borrower_listbox.get_children():
-            self.borrower_listbox.delete(i)
-        for borrower in self.system.search_borrowers(query):
-            self.borrower_listbox.insert('', tk.END, values=borrower)
+        self.sync_tree(self.borrower_listbox, self.borrower_rows, self.system.iter_search_borrowers(query))
 
     def search_loans(self):
         query = self.loan_search_entry.get().strip()
-        for i in self.loan_listbox.get_children():
-            self.loan_listbox.delete(i)
-        for loan in self.system.search_loans(query):
-            self.loan_listbox.insert('', tk.END, values=loan)
-
-    def update_borrower_list(self):
-        for i in self.borrower_listbox.get_children():
-            self.borrower_listbox.delete(i)
-        for borrower in self.system.get_all_borrowers():
-            self.borrower_listbox.insert('', tk.END, values=borrower)
-
-    def update_loan_list(self):
-        for i in self.loan_listbox.get_children():
-            self.loan_listbox.delete(i)
-        for loan in self.system.get_all_loans():
-            loan_id, borrower_name, amount, interest_rate, term_months, start_date, status = loan
-            balance = self.system.get_loan_balance(loan_id) # Assuming this method exists or will be added
-            self.loan_listbox.insert('', tk.END, values=(loan_id, borrower_name, amount, interest_rate, term_months, start_date, status, f"{balance:.2f}"))
+        loans = (self.loan_values(loan) for loan in self.system.iter_search_loans(query))
+        self.sync_tree(self.loan_listbox, self.loan_rows, loans)
+
+    def update_borrower_list(self, borrower_ids=None):
+        if borrower_ids is None:
+            self.sync_tree(self.borrower_listbox, self.borrower_rows, self.system.iter_all_borrowers())
+        else:
+            self.sync_tree(self.borrower_listbox, self.borrower_rows, self.system.get_borrowers_by_ids(borrower_ids), borrower_ids)
+
+    def update_loan_list(self, loan_ids=None):
+        if loan_ids is None:
+            loans = self.system.iter_all_loans()
+        else:
+            loans = self.system.get_loans_by_ids(loan_ids)
+        self.sync_tree(self.loan_listbox, self.loan_rows, (self.loan_values(loan) for loan in loans), loan_ids)
+
+    def loan_values(self, loan):
+        loan_id, borrower_name, amount, interest_rate, term_months, start_date, status = loan
+        balance = self.system.get_loan_balance(loan_id)
+        return (loan_id, borrower_name, amount, interest_rate, term_months, start_date, status, f"{balance:.2f}")
+
+    def sync_tree(self, tree, tracked, rows, keys=None):
+        # Rows are keyed by their primary key (first column), which is also the Treeview item id.
+        # With keys, only those rows are patched; otherwise the whole view is reconciled with rows.
+        incoming = {row[0]: tuple(row) for row in rows}
+        candidates = set(tracked) if keys is None else set(keys)
+        for key in candidates - incoming.keys():
+            if key in tracked:
+                tree.delete(key)
+                del tracked[key]
+        for index, (key, values) in enumerate(incoming.items()):
+            if key not in tracked:
+                tree.insert('', index if keys is None else tk.END, iid=key, values=values)
+            elif tracked[key] != values:
+                tree.item(key, values=values)
+            tracked[key] = values
 
     def update_dropdowns(self):
         names = self.system.get_borrower_names()
         self.borrower_name_dropdown['values'] = names
         self.payment_name_dropdown['values'] = names
 
+    def show_period_report(self, report):
+        start_date = self.report_start_entry.get().strip()
+        end_date = self.report_end_entry.get().strip()
+        try:
+            datetime.strptime(start_date, "%Y-%m-%d")
+            datetime.strptime(end_date, "%Y-%m-%d")
+        except ValueError:
+            messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format")
+            return
+        period = self.report_period_var.get().lower()
+        try:
+            if report == "collections":
+                rows = self.system.get_collections_report(start_date, end_date, period)
+            else:
+                rows = self.system.get_disbursements_report(start_date, end_date, period)
+        except (sqlite3.Error, ValueError) as e:
+            messagebox.showerror("Error", f"Failed to build report: {e}")
+            return
+        for i in self.period_report_listbox.get_children():
+            self.period_report_listbox.delete(i)
+        for period_label, count, total in rows:
+            self.period_report_listbox.insert('', tk.END, values=(period_label, count, f"{total:.2f}"))
+
     def export_report(self):
-        if self.system.export_loan_report():
+        if self.system.export_loan_report(self.include_archived_var.get()):
             messagebox.showinfo("Success", "Loan report exported to loan_report.csv")
         else:
             messagebox.showerror("Error", "Failed to export report")
 
+    def export_portfolio_summary(self):
+        file_path = filedialog.asksaveasfilename(defaultextension=".pdf", filetypes=[("PDF files", "*.pdf"), ("PNG images", "*.png")])
+        if not file_path:
+            return
+        data = self.system.get_dashboard_data()
+        title = (f"Portfolio Summary ({datetime.now().strftime('%Y-%m-%d')}) - "
+                 f"Total Loans: {data['total_loans']}, Total Amount: ₱{data['total_amount']:.2f}, "
+                 f"Active: {data['active_loans']}, Overdue: {data['overdue_loans']}")
+        try:
+            self.charts.export_summary(file_path, self.dashboard_charts(data), title)
+            messagebox.showinfo("Success", f"Portfolio summary exported to {file_path}")
+        except Exception as e:
+            # Also covers drawing errors re-raised from the render thread by future.result()
+            messagebox.showerror("Error", f"Failed to export summary: {e}")
+
     def backup_database(self):
         file_path = filedialog.asksaveasfilename(defaultextension=".db", filetypes=[("Database files", "*.db")])
         if file_path:
-            shutil.copy('loan_management.db', file_path)
-            messagebox.showinfo("Success", f"Database backed up to {file_path}")
+            try:
+                archive_path = self.system.backup_database(file_path)
+            except (sqlite3.Error, OSError) as e:
+                messagebox.showerror("Error", f"Failed to back up database: {e}")
+                return
+            messagebox.showinfo("Success", f"Database backed up to {file_path}\nArchived loans backed up to {archive_path}")
+
+    def archive_paid_loans(self):
+        try:
+            min_age_days = int(self.archive_age_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Invalid input")
+            return
+        if min_age_days < 0:
+            messagebox.showerror("Error", "Age must not be negative")
+            return
+        archived = self.system.archive_paid_loans(min_age_days)
+        if archived is None:
+            messagebox.showerror("Error", "Failed to archive loans")
+        else:
+            messagebox.showinfo("Success", f"{archived} paid loan(s) moved to loan_archive.db")
+            self.update_loan_list()
+            self.update_dashboard()
+
+    def export_changes(self):
+        # Defaults to everything since the last export; an earlier number re-sends changes,
+        # e.g. for a lost file or a second installation
+        since_seq = simpledialog.askinteger("Export Changes", "Export changes after sequence number:",
+                                            initialvalue=int(self.system.get_sync_state('last_export_seq') or 0),
+                                            minvalue=0, parent=self.root)
+        if since_seq is None:
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".changes.gz", filetypes=[("Changeset files", "*.changes.gz")])
+        if not file_path:
+            return
+        try:
+            count = self.system.export_changes(file_path, since_seq)
+        except (OSError, sqlite3.Error) as e:
+            messagebox.showerror("Error", f"Failed to export changes: {e}")
+            return
+        messagebox.showinfo("Success", f"{count} change(s) exported to {file_path}")
+
+    def reset_site_id(self):
+        if not messagebox.askyesno("New Installation ID", "Only do this on a database copied from another installation. Continue?"):
+            return
+        try:
+            site_id = self.system.reset_site_id()
+        except sqlite3.Error as e:
+            messagebox.showerror("Error", f"Failed to reset installation ID: {e}")
+            return
+        messagebox.showinfo("Success", f"New installation ID: {site_id}")
+
+    def import_changes(self):
+        file_path = filedialog.askopenfilename(filetypes=[("Changeset files", "*.changes.gz")])
+        if not file_path:
+            return
+        result = self.system.import_changes(file_path)
+        if result is None:
+            messagebox.showerror("Error", "Failed to import changes")
+        elif isinstance(result, str):
+            messagebox.showerror("Error", result)
+        else:
+            messagebox.showinfo("Success", f"Applied: {result['applied']}, Skipped: {result['skipped']}, Conflicts: {result['conflicts']}")
+            self.update_borrower_list()
+            self.update_loan_list()
+            self.update_dropdowns()
+            self.update_dashboard()
 
     def logout(self):
         self.main_content_frame.pack_forget()  # Hide the main application content
@@ -475,6 +638,7 @@ class LoanApp:
         ttk.Button(dialog, text="Change Password", command=change_password_action).pack(pady=10)
 
     def __del__(self):
+        self.charts.close()
         self.system.close()
 
     def setup_main_menu(self):
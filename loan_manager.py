@@ -1,12 +1,99 @@
 import sqlite3
 from datetime import datetime, timedelta
-import pandas as pd
+from collections import namedtuple
 import hashlib
+import random
+import time
+import csv
+import os
+import gzip
+import json
+import uuid
+from database_setup import create_archive_tables, TRACKED_TABLES, BUSY_TIMEOUT
+
+# Tracked tables whose rows can be moved to the archive database
+ARCHIVED_TABLES = ('loans', 'payments')
+
+# Foreign key column and parent table of tracked child tables
+PARENT_KEYS = {
+    'loans': ('borrower_id', 'borrowers'),
+    'payments': ('loan_id', 'loans'),
+}
+
+# SQL expressions that map a YYYY-MM-DD day to its report period
+REPORT_PERIODS = {
+    'day': 'day',
+    'week': "date(day, 'weekday 0', '-6 days')",
+    'month': 'substr(day, 1, 7)',
+}
+
+# Days of payments and loans aggregated per daily_totals write transaction
+ROLLUP_CHUNK_DAYS = 31
+
+# Date column of each table summarized in daily_totals
+ROLLUP_DATE_COLUMNS = {
+    'payments': 'payment_date',
+    'loans': 'start_date',
+}
+
+# Attempts made by write_transaction when the database stays locked past BUSY_TIMEOUT
+WRITE_RETRIES = 5
+RETRY_BACKOFF = 0.05
+
+# Bars in the dashboard loan amount histogram
+AMOUNT_BINS = 10
+
+# Rows fetched per round trip by the iter_* methods
+FETCH_BATCH_SIZE = 1000
+
+BorrowerRow = namedtuple('BorrowerRow', 'borrower_id full_name contact email address id_type id_number')
+LoanRow = namedtuple('LoanRow', 'loan_id full_name amount interest_rate term_months start_date status')
+PaymentRow = namedtuple('PaymentRow', 'payment_id loan_id amount payment_date balance_after_payment')
+
+LOAN_LIST_QUERY = ('SELECT l.loan_id, b.full_name, l.amount, l.interest_rate, l.term_months, l.start_date, l.status '
+                   'FROM {loans} l JOIN borrowers b ON l.borrower_id = b.borrower_id')
+
+def is_busy_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
 
 class LoanManagementSystem:
-    def __init__(self):
-        self.conn = sqlite3.connect('loan_management.db')
+    def __init__(self, archive_path='loan_archive.db'):
+        self.conn = sqlite3.connect('loan_management.db', timeout=BUSY_TIMEOUT)
         self.cursor = self.conn.cursor()
+        self.attach_archive(archive_path)
+
+    def attach_archive(self, archive_path):
+        # Closed loans live in a separate file; the all_* views span both databases
+        self.cursor.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+        create_archive_tables(self.cursor)
+        self.cursor.execute('CREATE TEMP VIEW IF NOT EXISTS all_loans AS '
+                          'SELECT * FROM main.loans UNION ALL SELECT * FROM archive.loans')
+        self.cursor.execute('CREATE TEMP VIEW IF NOT EXISTS all_payments AS '
+                          'SELECT * FROM main.payments UNION ALL SELECT * FROM archive.payments')
+        self.conn.commit()
+
+    def write_transaction(self, work):
+        # BEGIN IMMEDIATE takes the write lock before work() reads anything, so read-then-write
+        # sequences such as balance calculations cannot interleave with another instance
+        delay = RETRY_BACKOFF
+        for attempt in range(WRITE_RETRIES):
+            try:
+                self.cursor.execute('BEGIN IMMEDIATE')
+                result = work()
+                self.conn.commit()
+                return result
+            except sqlite3.OperationalError as e:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                if not is_busy_error(e) or attempt == WRITE_RETRIES - 1:
+                    raise
+                time.sleep(delay + random.uniform(0, delay))
+                delay *= 2
+            except Exception:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                raise
 
     def authenticate_user(self, username, password):
         hashed_password = hashlib.sha256(password.encode()).hexdigest()
@@ -15,81 +102,90 @@ class LoanManagementSystem:
 
     def change_password(self, username, new_password):
         hashed_password = hashlib.sha256(new_password.encode()).hexdigest()
-        self.cursor.execute("UPDATE users SET password_hash = ? WHERE username = ?", (hashed_password, username))
-        self.conn.commit()
-        return self.cursor.rowcount > 0
+
+        def update_password():
+            self.cursor.execute("UPDATE users SET password_hash = ? WHERE username = ?", (hashed_password, username))
+            return self.cursor.rowcount > 0
+        return self.write_transaction(update_password)
 
     def add_borrower(self, full_name, contact, email, address, id_type, id_number):
-        try:
+        def insert_borrower():
             self.cursor.execute('INSERT INTO borrowers (full_name, contact, email, address, id_type, id_number) '
                               'VALUES (?, ?, ?, ?, ?, ?)',
                               (full_name, contact, email, address, id_type, id_number))
-            self.conn.commit()
             return self.cursor.lastrowid
+        try:
+            return self.write_transaction(insert_borrower)
         except sqlite3.IntegrityError:
             return None
 
     def add_loan(self, borrower_id, amount, interest_rate, term_months, start_date):
-        try:
+        def insert_loan():
             status = "Active"
             self.cursor.execute('INSERT INTO loans (borrower_id, amount, interest_rate, term_months, start_date, status) '
                               'VALUES (?, ?, ?, ?, ?, ?)',
                               (borrower_id, amount, interest_rate, term_months, start_date, status))
-            self.conn.commit()
             return self.cursor.lastrowid
+        try:
+            return self.write_transaction(insert_loan)
         except sqlite3.IntegrityError:
             return None
 
     def record_payment(self, loan_id, amount, payment_date):
-        try:
+        def post_payment():
             self.cursor.execute('SELECT amount, interest_rate, term_months, start_date FROM loans WHERE loan_id = ?', (loan_id,))
             loan = self.cursor.fetchone()
             if not loan:
                 return "Loan not found"
-            
+
             self.cursor.execute('SELECT SUM(amount) FROM payments WHERE loan_id = ?', (loan_id,))
             total_paid = self.cursor.fetchone()[0] or 0
             new_balance = loan[0] - total_paid - amount
-            
+
             self.cursor.execute('INSERT INTO payments (loan_id, amount, payment_date, balance_after_payment) '
                               'VALUES (?, ?, ?, ?)', (loan_id, amount, payment_date, new_balance))
-            
+
             status = "Paid" if new_balance <= 0 else "Active"
             start_date = datetime.strptime(loan[3], "%Y-%m-%d")
             if (datetime.now() - start_date).days > 30 and new_balance > 0:
                 status = "Overdue"
             self.cursor.execute('UPDATE loans SET status = ? WHERE loan_id = ?', (status, loan_id))
-            
-            self.conn.commit()
             return new_balance
-        except sqlite3.Error:
-            return None
+        try:
+            return self.write_transaction(post_payment)
+        except sqlite3.Error as e:
+            return f"Failed to record payment: {e}"
 
-    def get_loan_summary(self, loan_id):
-        self.cursor.execute('SELECT * FROM loans WHERE loan_id = ?', (loan_id,))
+    def get_loan_summary(self, loan_id, include_archived=False):
+        loans = 'all_loans' if include_archived else 'loans'
+        self.cursor.execute(f'SELECT * FROM {loans} WHERE loan_id = ?', (loan_id,))
         loan = self.cursor.fetchone()
-        self.cursor.execute('SELECT * FROM payments WHERE loan_id = ?', (loan_id,))
-        payments = self.cursor.fetchall()
+        payments = list(self.iter_loan_payments(loan_id, include_archived))
         return {"loan": loan, "payments": payments}
 
-    def get_dashboard_data(self):
-        self.cursor.execute('SELECT COUNT(*) FROM loans')
+    def iter_loan_payments(self, loan_id, include_archived=False, named=False, arraysize=FETCH_BATCH_SIZE):
+        payments = 'all_payments' if include_archived else 'payments'
+        return self.iter_rows(f'SELECT * FROM {payments} WHERE loan_id = ?', (loan_id,),
+                              PaymentRow if named else None, arraysize)
+
+    def get_dashboard_data(self, include_archived=False):
+        loans = 'all_loans' if include_archived else 'loans'
+        self.cursor.execute(f'SELECT COUNT(*) FROM {loans}')
         total_loans = self.cursor.fetchone()[0]
         
-        self.cursor.execute('SELECT SUM(amount) FROM loans')
+        self.cursor.execute(f'SELECT SUM(amount) FROM {loans}')
         total_amount = self.cursor.fetchone()[0] or 0
         
-        self.cursor.execute('SELECT COUNT(*) FROM loans WHERE status = "Active"')
+        self.cursor.execute(f'SELECT COUNT(*) FROM {loans} WHERE status = "Active"')
         active_loans = self.cursor.fetchone()[0]
         
-        self.cursor.execute('SELECT COUNT(*) FROM loans WHERE status = "Overdue"')
+        self.cursor.execute(f'SELECT COUNT(*) FROM {loans} WHERE status = "Overdue"')
         overdue_loans = self.cursor.fetchone()[0]
         
-        self.cursor.execute('SELECT status, COUNT(*) FROM loans GROUP BY status')
+        self.cursor.execute(f'SELECT status, COUNT(*) FROM {loans} GROUP BY status')
         status_data = self.cursor.fetchall()
         
-        self.cursor.execute('SELECT amount FROM loans')
-        amounts = [row[0] for row in self.cursor.fetchall()]
+        amount_bins = self.get_amount_bins(loans)
         
         return {
             "total_loans": total_loans,
@@ -97,37 +193,93 @@ class LoanManagementSystem:
             "active_loans": active_loans,
             "overdue_loans": overdue_loans,
             "status_data": status_data,
-            "amounts": amounts
+            "amount_bins": amount_bins
         }
 
+    def get_amount_bins(self, loans='loans'):
+        # Histogram of loan amounts as (bin_start, bin_end, count), binned in SQL
+        self.cursor.execute(f'SELECT MIN(amount), MAX(amount) FROM {loans}')
+        low, high = self.cursor.fetchone()
+        if low is None:
+            return []
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        width = (high - low) / AMOUNT_BINS
+        self.cursor.execute(f'SELECT MIN(CAST((amount - ?) / ? AS INTEGER), ?) AS bin, COUNT(*) FROM {loans} GROUP BY bin',
+                          (low, width, AMOUNT_BINS - 1))
+        counts = dict(self.cursor.fetchall())
+        return [(low + i * width, low + (i + 1) * width, counts.get(i, 0)) for i in range(AMOUNT_BINS)]
+
+    def iter_rows(self, sql, params=(), row_type=None, arraysize=FETCH_BATCH_SIZE):
+        # Uses its own cursor so other queries can run while the caller is iterating
+        cursor = self.conn.cursor()
+        cursor.arraysize = arraysize
+        if row_type is not None:
+            cursor.row_factory = lambda cursor, row: row_type._make(row)
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    def iter_all_borrowers(self, named=False, arraysize=FETCH_BATCH_SIZE):
+        return self.iter_rows('SELECT * FROM borrowers', (), BorrowerRow if named else None, arraysize)
+
     def get_all_borrowers(self):
-        self.cursor.execute('SELECT * FROM borrowers')
+        return list(self.iter_all_borrowers())
+
+    def iter_all_loans(self, include_archived=False, named=False, arraysize=FETCH_BATCH_SIZE):
+        loans = 'all_loans' if include_archived else 'loans'
+        return self.iter_rows(LOAN_LIST_QUERY.format(loans=loans), (), LoanRow if named else None, arraysize)
+
+    def get_all_loans(self, include_archived=False):
+        return list(self.iter_all_loans(include_archived))
+
+    def get_borrowers_by_ids(self, borrower_ids):
+        borrower_ids = list(borrower_ids)
+        if not borrower_ids:
+            return []
+        placeholders = ', '.join('?' * len(borrower_ids))
+        self.cursor.execute(f'SELECT * FROM borrowers WHERE borrower_id IN ({placeholders})', borrower_ids)
         return self.cursor.fetchall()
 
-    def get_all_loans(self):
-        self.cursor.execute('SELECT l.loan_id, b.full_name, l.amount, l.interest_rate, l.term_months, l.start_date, l.status '
-                          'FROM loans l JOIN borrowers b ON l.borrower_id = b.borrower_id')
+    def get_loans_by_ids(self, loan_ids):
+        loan_ids = list(loan_ids)
+        if not loan_ids:
+            return []
+        placeholders = ', '.join('?' * len(loan_ids))
+        self.cursor.execute(LOAN_LIST_QUERY.format(loans='loans') + f' WHERE l.loan_id IN ({placeholders})', loan_ids)
         return self.cursor.fetchall()
 
+    def iter_search_borrowers(self, query, named=False, arraysize=FETCH_BATCH_SIZE):
+        return self.iter_rows('SELECT * FROM borrowers WHERE full_name LIKE ? OR id_number LIKE ?',
+                              (f'%{query}%', f'%{query}%'), BorrowerRow if named else None, arraysize)
+
     def search_borrowers(self, query):
-        self.cursor.execute('SELECT * FROM borrowers WHERE full_name LIKE ? OR id_number LIKE ?',
-                          (f'%{query}%', f'%{query}%'))
-        return self.cursor.fetchall()
+        return list(self.iter_search_borrowers(query))
 
-    def search_loans(self, query):
-        self.cursor.execute('SELECT l.loan_id, b.full_name, l.amount, l.interest_rate, l.term_months, l.start_date, l.status '
-                          'FROM loans l JOIN borrowers b ON l.borrower_id = b.borrower_id '
-                          'WHERE b.full_name LIKE ? OR l.loan_id LIKE ?',
-                          (f'%{query}%', f'%{query}%'))
-        return self.cursor.fetchall()
+    def iter_search_loans(self, query, include_archived=False, named=False, arraysize=FETCH_BATCH_SIZE):
+        loans = 'all_loans' if include_archived else 'loans'
+        return self.iter_rows(LOAN_LIST_QUERY.format(loans=loans) + ' WHERE b.full_name LIKE ? OR l.loan_id LIKE ?',
+                              (f'%{query}%', f'%{query}%'), LoanRow if named else None, arraysize)
+
+    def search_loans(self, query, include_archived=False):
+        return list(self.iter_search_loans(query, include_archived))
 
     def get_borrower_by_name(self, full_name):
         self.cursor.execute('SELECT borrower_id FROM borrowers WHERE full_name = ?', (full_name,))
         return self.cursor.fetchone()
 
+    def iter_borrower_names(self, arraysize=FETCH_BATCH_SIZE):
+        for row in self.iter_rows('SELECT full_name FROM borrowers', (), None, arraysize):
+            yield row[0]
+
     def get_borrower_names(self):
-        self.cursor.execute('SELECT full_name FROM borrowers')
-        return [row[0] for row in self.cursor.fetchall()]
+        return list(self.iter_borrower_names())
 
     def get_loan_balance(self, loan_id):
         self.cursor.execute('SELECT amount FROM loans WHERE loan_id = ?', (loan_id,))
@@ -136,11 +288,309 @@ class LoanManagementSystem:
         total_paid = self.cursor.fetchone()[0] or 0
         return loan_amount - total_paid
 
-    def export_loan_report(self):
-        loans = pd.read_sql_query('SELECT l.loan_id, b.full_name, l.amount, l.interest_rate, l.term_months, l.start_date, l.status '
-                                 'FROM loans l JOIN borrowers b ON l.borrower_id = b.borrower_id', self.conn)
-        loans.to_csv('loan_report.csv', index=False)
+    def export_loan_report(self, include_archived=False):
+        with open('loan_report.csv', 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(LoanRow._fields)
+            writer.writerows(self.iter_all_loans(include_archived))
         return True
 
+    def backup_database(self, file_path):
+        # The online backup API gives a consistent copy even while other instances write
+        archive_path = os.path.splitext(file_path)[0] + '_archive.db'
+        for schema, target_path in (('main', file_path), ('archive', archive_path)):
+            target = sqlite3.connect(target_path)
+            try:
+                self.conn.backup(target, name=schema)
+            finally:
+                target.close()
+        return archive_path
+
+    def archive_paid_loans(self, min_age_days=365):
+        cutoff = (datetime.now() - timedelta(days=min_age_days)).strftime("%Y-%m-%d")
+
+        def move_loans():
+            # Archival is local housekeeping, so the deletes are not sent to other sites
+            self.set_change_tracking(False)
+            self.cursor.execute('CREATE TEMP TABLE IF NOT EXISTS archive_batch (loan_id INTEGER PRIMARY KEY)')
+            self.cursor.execute('DELETE FROM archive_batch')
+            self.cursor.execute('INSERT INTO archive_batch (loan_id) '
+                              'SELECT l.loan_id FROM main.loans l '
+                              "WHERE l.status = 'Paid' AND "
+                              '(SELECT MAX(p.payment_date) FROM main.payments p WHERE p.loan_id = l.loan_id) <= ?',
+                              (cutoff,))
+            archived = self.cursor.rowcount
+            self.cursor.execute('INSERT INTO archive.loans SELECT * FROM main.loans '
+                              'WHERE loan_id IN (SELECT loan_id FROM archive_batch)')
+            self.cursor.execute('INSERT INTO archive.payments SELECT * FROM main.payments '
+                              'WHERE loan_id IN (SELECT loan_id FROM archive_batch)')
+            self.cursor.execute('DELETE FROM main.payments WHERE loan_id IN (SELECT loan_id FROM archive_batch)')
+            self.cursor.execute('DELETE FROM main.loans WHERE loan_id IN (SELECT loan_id FROM archive_batch)')
+            self.set_change_tracking(True)
+            return archived
+        try:
+            return self.write_transaction(move_loans)
+        except sqlite3.Error:
+            return None
+
+    def get_rolled_up_to(self):
+        self.cursor.execute('SELECT MAX(day) FROM daily_totals')
+        return self.cursor.fetchone()[0] or ''
+
+    def get_rollup_chunk_end(self, rolled_up_to, yesterday):
+        # Skips straight to the next day with any payment or loan, then covers ROLLUP_CHUNK_DAYS
+        first_days = []
+        for schema in ('main', 'archive'):
+            for table, date_column in (('payments', 'payment_date'), ('loans', 'start_date')):
+                self.cursor.execute(f'SELECT MIN({date_column}) FROM {schema}.{table} WHERE {date_column} > ?', (rolled_up_to,))
+                first_days.append(self.cursor.fetchone()[0])
+        first_days = [day for day in first_days if day]
+        if not first_days or min(first_days) >= yesterday:
+            return yesterday
+        chunk_end = datetime.strptime(min(first_days), "%Y-%m-%d") + timedelta(days=ROLLUP_CHUNK_DAYS - 1)
+        return min(chunk_end.strftime("%Y-%m-%d"), yesterday)
+
+    def get_daily_totals(self, after_day, through_day):
+        # Archived loans and payments still count towards their days. The base tables are
+        # read directly rather than through the all_* views so the covering indexes apply.
+        parts = []
+        for schema in ('main', 'archive'):
+            parts.append('SELECT payment_date AS day, COUNT(*) AS cc, SUM(amount) AS ca, 0 AS dc, 0 AS da '
+                         f'FROM {schema}.payments WHERE payment_date > ? AND payment_date <= ? GROUP BY payment_date')
+            parts.append('SELECT start_date, 0, 0, COUNT(*), SUM(amount) '
+                         f'FROM {schema}.loans WHERE start_date > ? AND start_date <= ? GROUP BY start_date')
+        self.cursor.execute(f'SELECT day, SUM(cc), SUM(ca), SUM(dc), SUM(da) FROM ({" UNION ALL ".join(parts)}) GROUP BY day',
+                          (after_day, through_day) * len(parts))
+        return self.cursor.fetchall()
+
+    def refresh_daily_totals(self):
+        # Rolls up closed days one chunk at a time. Each chunk is aggregated before the write
+        # lock is taken, so other instances only wait for the short insert of its results.
+        yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        while True:
+            rolled_up_to = self.get_rolled_up_to()
+            if rolled_up_to >= yesterday:
+                return
+            chunk_end = self.get_rollup_chunk_end(rolled_up_to, yesterday)
+            totals = self.get_daily_totals(rolled_up_to, chunk_end)
+
+            def store_totals():
+                # Another instance or an import moved the roll-up point meanwhile; start over from it
+                if self.get_rolled_up_to() != rolled_up_to:
+                    return
+                self.cursor.executemany('INSERT OR REPLACE INTO daily_totals '
+                                      '(day, collections_count, collections_amount, disbursements_count, disbursements_amount) '
+                                      'VALUES (?, ?, ?, ?, ?)', totals)
+                # Marks the chunk as rolled up even when nothing happened on its last day
+                self.cursor.execute('INSERT OR IGNORE INTO daily_totals VALUES (?, 0, 0, 0, 0)', (chunk_end,))
+            self.write_transaction(store_totals)
+
+    def get_collections_report(self, start_date, end_date, period='day'):
+        return self.get_period_report('collections', 'all_payments', 'payment_date', start_date, end_date, period)
+
+    def get_disbursements_report(self, start_date, end_date, period='day'):
+        return self.get_period_report('disbursements', 'all_loans', 'start_date', start_date, end_date, period)
+
+    def get_period_report(self, totals, source, date_column, start_date, end_date, period):
+        if period not in REPORT_PERIODS:
+            raise ValueError(f"Unknown report period: {period}")
+        self.refresh_daily_totals()
+        today = datetime.now().strftime("%Y-%m-%d")
+        # Closed days come from daily_totals, today and later from the live tables
+        self.cursor.execute(f'SELECT {REPORT_PERIODS[period]} AS period, SUM(count), SUM(total) FROM ('
+                          f'SELECT day, {totals}_count AS count, {totals}_amount AS total FROM daily_totals '
+                          'WHERE day BETWEEN ? AND ? AND day < ? '
+                          'UNION ALL '
+                          f'SELECT {date_column} AS day, COUNT(*), SUM(amount) FROM {source} '
+                          f'WHERE {date_column} BETWEEN ? AND ? AND {date_column} >= ? GROUP BY {date_column}'
+                          ') WHERE count > 0 GROUP BY period ORDER BY period',
+                          (start_date, end_date, today, start_date, end_date, today))
+        return self.cursor.fetchall()
+
+    def get_sync_state(self, key):
+        self.cursor.execute('SELECT value FROM sync_state WHERE key = ?', (key,))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def set_change_tracking(self, enabled):
+        self.cursor.execute("UPDATE sync_state SET value = ? WHERE key = 'tracking'", ('on' if enabled else 'off',))
+
+    def get_table_columns(self, table):
+        self.cursor.execute(f'PRAGMA table_info({table})')
+        return [row[1] for row in self.cursor.fetchall()]
+
+    def get_row_origin(self, table, row_id):
+        self.cursor.execute('SELECT site_id FROM row_origins WHERE table_name = ? AND row_id = ?', (table, row_id))
+        row = self.cursor.fetchone()
+        return row[0] if row else self.get_sync_state('site_id')
+
+    def find_tracked_row(self, table, row_id, schema='main'):
+        if schema == 'archive' and table not in ARCHIVED_TABLES:
+            return None
+        self.cursor.execute(f'SELECT * FROM {schema}.{table} WHERE {TRACKED_TABLES[table]} = ?', (row_id,))
+        row = self.cursor.fetchone()
+        return dict(zip([column[0] for column in self.cursor.description], row)) if row else None
+
+    def export_changes(self, file_path, since_seq=None):
+        if since_seq is None:
+            since_seq = int(self.get_sync_state('last_export_seq') or 0)
+        # Only the latest state of each changed row is exported
+        self.cursor.execute('SELECT table_name, row_id, MAX(seq) FROM change_log WHERE seq > ? '
+                          'GROUP BY table_name, row_id ORDER BY MAX(seq)', (since_seq,))
+        latest = self.cursor.fetchall()
+        changes = []
+        for table, row_id, seq in latest:
+            # Archived rows still exist here, so they are sent as they are rather than as deletes
+            row = self.find_tracked_row(table, row_id) or self.find_tracked_row(table, row_id, 'archive')
+            change = {"seq": seq, "table": table, "row_id": row_id, "origin": self.get_row_origin(table, row_id)}
+            if row is None:
+                change["op"] = "DELETE"
+            else:
+                change["op"] = "UPSERT"
+                change["row"] = row
+                if table in PARENT_KEYS:
+                    column, parent_table = PARENT_KEYS[table]
+                    change["parent_origin"] = self.get_row_origin(parent_table, row[column])
+            changes.append(change)
+        to_seq = latest[-1][2] if latest else since_seq
+        changeset = {
+            "site_id": self.get_sync_state('site_id'),
+            "since_seq": since_seq,
+            "to_seq": to_seq,
+            "changes": changes
+        }
+        with gzip.open(file_path, 'wt', encoding='utf-8') as f:
+            json.dump(changeset, f, separators=(',', ':'))
+
+        def finish_export():
+            # Re-exporting from an earlier sequence never moves the marker backwards
+            self.cursor.execute("UPDATE sync_state SET value = MAX(CAST(value AS INTEGER), ?) WHERE key = 'last_export_seq'",
+                              (to_seq,))
+            # Exports only ever send a row's latest change, so older log entries for it can go
+            self.cursor.executemany('DELETE FROM change_log WHERE table_name = ? AND row_id = ? AND seq < ?', latest)
+        self.write_transaction(finish_export)
+        return len(changes)
+
+    def reset_site_id(self):
+        # For a database copied from another installation. Rows that already exist were created
+        # by the original installation, so they keep its id as their origin.
+        old_site_id = self.get_sync_state('site_id')
+        new_site_id = uuid.uuid4().hex
+
+        def assign_site_id():
+            for table, key in TRACKED_TABLES.items():
+                for schema in (('main', 'archive') if table in ARCHIVED_TABLES else ('main',)):
+                    self.cursor.execute('INSERT OR IGNORE INTO row_origins (table_name, row_id, site_id) '
+                                      f"SELECT '{table}', {key}, ? FROM {schema}.{table}", (old_site_id,))
+            self.cursor.execute("UPDATE sync_state SET value = ? WHERE key = 'site_id'", (new_site_id,))
+            return new_site_id
+        return self.write_transaction(assign_site_id)
+
+    def get_import_conflict(self, change, origin, current, archived, pending_seq):
+        table, row_id, incoming = change["table"], change["row_id"], change.get("row")
+        if archived is not None:
+            return "Row is archived at this site"
+        if table == 'payments' and incoming is not None and self.find_tracked_row('loans', incoming.get("loan_id"), 'archive'):
+            return "Payment is for a loan that is archived at this site"
+        if table in PARENT_KEYS and incoming is not None:
+            # The parent id is also only unique per site, so it must be the sender's record here too
+            column, parent_table = PARENT_KEYS[table]
+            parent_id = incoming.get(column)
+            parent_origin = change.get("parent_origin", origin)
+            parent = (self.find_tracked_row(parent_table, parent_id)
+                      or self.find_tracked_row(parent_table, parent_id, 'archive'))
+            if parent is None:
+                return f"Parent {parent_table} row {parent_id} is not at this site"
+            if self.get_row_origin(parent_table, parent_id) != parent_origin:
+                return f"Parent {parent_table} row {parent_id} here was created by another site than {parent_origin}"
+        if current is None:
+            return None
+        # Row ids are only unique per site, so the same id from another site is a different record
+        if self.get_row_origin(table, row_id) != origin:
+            return f"Row {row_id} here was created by another site than {origin}"
+        self.cursor.execute('SELECT 1 FROM change_log WHERE table_name = ? AND row_id = ? AND seq > ? LIMIT 1',
+                          (table, row_id, pending_seq))
+        if self.cursor.fetchone():
+            return "Row has local edits that have not been exported"
+        return None
+
+    def import_changes(self, file_path):
+        try:
+            with gzip.open(file_path, 'rt', encoding='utf-8') as f:
+                changeset = json.load(f)
+            site_id = changeset["site_id"]
+            changes = changeset["changes"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return "Invalid changeset file"
+        own_site_id = self.get_sync_state('site_id')
+        if site_id == own_site_id:
+            return ("Changeset was exported from this installation. If this database was copied from "
+                    "another installation, use New Installation ID first.")
+
+        def apply_changes():
+            self.cursor.execute('SELECT last_seq FROM sync_peers WHERE site_id = ?', (site_id,))
+            peer = self.cursor.fetchone()
+            last_seq = peer[0] if peer else 0
+            pending_seq = int(self.get_sync_state('last_export_seq') or 0)
+            self.set_change_tracking(False)
+            result = {"applied": 0, "skipped": 0, "conflicts": 0}
+            touched_days = []
+            # Parents are applied before children so their rows exist when children are checked
+            table_order = list(TRACKED_TABLES)
+            for change in sorted(changes, key=lambda change: (table_order.index(change["table"])
+                                                              if change["table"] in table_order else len(table_order),
+                                                              change["seq"])):
+                table = change["table"]
+                if change["seq"] <= last_seq or table not in TRACKED_TABLES:
+                    result["skipped"] += 1
+                    continue
+                key = TRACKED_TABLES[table]
+                row_id = change["row_id"]
+                origin = change.get("origin", site_id)
+                incoming = change.get("row")
+                current = self.find_tracked_row(table, row_id)
+                archived = None if current else self.find_tracked_row(table, row_id, 'archive')
+                if (current or archived) == incoming:
+                    result["skipped"] += 1
+                    continue
+
+                conflict = self.get_import_conflict(change, origin, current, archived, pending_seq)
+                if conflict:
+                    self.cursor.execute('INSERT INTO sync_conflicts (site_id, seq, table_name, row_id, operation, incoming_row, reason, detected_at) '
+                                      'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                      (site_id, change["seq"], table, row_id, change["op"],
+                                       json.dumps(incoming) if incoming else None, conflict,
+                                       datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+                    result["conflicts"] += 1
+                    continue
+
+                if table in ROLLUP_DATE_COLUMNS:
+                    touched_days += [row[ROLLUP_DATE_COLUMNS[table]] for row in (current, incoming) if row]
+                if change["op"] == "DELETE" or origin == own_site_id:
+                    self.cursor.execute('DELETE FROM row_origins WHERE table_name = ? AND row_id = ?', (table, row_id))
+                else:
+                    self.cursor.execute('INSERT OR REPLACE INTO row_origins (table_name, row_id, site_id) VALUES (?, ?, ?)',
+                                      (table, row_id, origin))
+                if change["op"] == "DELETE":
+                    self.cursor.execute(f'DELETE FROM {table} WHERE {key} = ?', (row_id,))
+                else:
+                    columns = self.get_table_columns(table)
+                    placeholders = ', '.join('?' * len(columns))
+                    self.cursor.execute(f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}) VALUES ({placeholders})',
+                                      [incoming.get(column) for column in columns])
+                result["applied"] += 1
+
+            # Imported rows may be back-dated into days that were already rolled up
+            if touched_days:
+                self.cursor.execute('DELETE FROM daily_totals WHERE day >= ?', (min(touched_days),))
+            self.cursor.execute('INSERT OR REPLACE INTO sync_peers (site_id, last_seq) VALUES (?, ?)',
+                              (site_id, max(last_seq, changeset.get("to_seq", 0))))
+            self.set_change_tracking(True)
+            return result
+        try:
+            return self.write_transaction(apply_changes)
+        except (sqlite3.Error, KeyError, TypeError, AttributeError):
+            return None
+
     def close(self):
         self.conn.close()
\ No newline at end of file
@@ -0,0 +1,70 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from database_setup import create_database
+from loan_manager import LoanManagementSystem
+
+# Posts payments from several processes at once against one database file in a temporary
+# folder, then checks that every loan's balance is exact and reports throughput.
+
+LOAN_AMOUNT = 1_000_000
+PAYMENT_AMOUNT = 1
+
+def post_payments(folder, loan_ids, count):
+    os.chdir(folder)
+    system = LoanManagementSystem()
+    errors = []
+    for i in range(count):
+        result = system.record_payment(loan_ids[i % len(loan_ids)], PAYMENT_AMOUNT, '2025-01-01')
+        if isinstance(result, str):
+            errors.append(result)
+    system.close()
+    return errors
+
+def check_balances(system, loan_ids, expected_posts):
+    total_posts = 0
+    for loan_id in loan_ids:
+        system.cursor.execute('SELECT COUNT(*), MIN(balance_after_payment), COUNT(DISTINCT balance_after_payment) '
+                              'FROM payments WHERE loan_id = ?', (loan_id,))
+        posts, lowest_balance, distinct_balances = system.cursor.fetchone()
+        expected_balance = LOAN_AMOUNT - posts * PAYMENT_AMOUNT
+        # Each payment must have seen every earlier one, so running balances never repeat
+        assert system.get_loan_balance(loan_id) == expected_balance, f"loan {loan_id}: balance mismatch"
+        assert lowest_balance == expected_balance, f"loan {loan_id}: balance_after_payment mismatch"
+        assert distinct_balances == posts, f"loan {loan_id}: two payments computed the same balance"
+        total_posts += posts
+    assert total_posts == expected_posts, f"expected {expected_posts} payments, found {total_posts}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent payment posting stress test")
+    parser.add_argument('--payments', type=int, default=4000, help="payments posted per run")
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--loans', type=int, default=3, help="loans the payments are spread over")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        create_database()
+        system = LoanManagementSystem()
+        borrower_id = system.add_borrower('Stress Borrower', '', '', '', '', '')
+        expected_posts = 0
+        for processes in args.processes:
+            loan_ids = [system.add_loan(borrower_id, LOAN_AMOUNT, 5, 12, '2025-01-01') for _ in range(args.loans)]
+            per_process = args.payments // processes
+            start = time.perf_counter()
+            with multiprocessing.Pool(processes) as pool:
+                results = pool.starmap(post_payments, [(folder, loan_ids, per_process)] * processes)
+            elapsed = time.perf_counter() - start
+            errors = [error for result in results for error in result]
+            assert not errors, f"{len(errors)} payments failed, first: {errors[0]}"
+            check_balances(system, loan_ids, per_process * processes)
+            expected_posts += per_process * processes
+            print(f"{processes:>3} processes  {per_process * processes:>6} payments  {per_process * processes / elapsed:8.0f} posts/s")
+        system.close()
+        os.chdir(os.path.dirname(folder))
+    print(f"OK: {expected_posts} payments posted, all balances exact")
+
+if __name__ == "__main__":
+    main()